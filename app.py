@@ -1,121 +1,205 @@
-import subprocess
-import sys
-
-def install_if_missing(pip_package, import_name=None):
-    import_name = import_name or pip_package
-    try:
-        __import__(import_name)
-    except ImportError:
-        subprocess.check_call(
-            [sys.executable, "-m", "pip", "install", "--upgrade", pip_package],
-            stdout=subprocess.DEVNULL,
-            stderr=subprocess.DEVNULL
-        )
-        
-# Attempt to install 'icd10-cm' only if not present
-install_if_missing("icd10-cm")
-install_if_missing("rapidfuzz")
-install_if_missing("icdcodex")
-install_if_missing("pandas")
-install_if_missing("gradio")
-install_if_missing("nltk")
-
+import ahocorasick
 import gradio as gr
+import numpy as np
 import pandas as pd
 import icd10
 import re
 import os
-from icdcodex import icd2vec, hierarchy
+import hashlib
+import pickle
+import atexit
+import queue
+import threading
+import icdcodex
+from icdcodex import hierarchy
 from rapidfuzz import process, fuzz
+from rapidfuzz.utils import default_process
 from datetime import datetime
+from functools import lru_cache
+
+from nltk.stem import PorterStemmer
+
+stemmer = PorterStemmer()
+
+# Precompiled patterns for preprocess_input, so each query pays a couple of
+# regex passes rather than the full Punkt/WordNet pipeline.
+_CLEAN = re.compile(r'[^a-z0-9\s-]')
+_WS = re.compile(r'\s+')
+_TOK = re.compile(r"[a-z0-9][a-z0-9-]*")
 
-import nltk
-from nltk.stem import WordNetLemmatizer
-from nltk.corpus import wordnet
+# ========== Setup: Load ICD Hierarchy ==========
+ICD_VERSION = "2025"  # or "2024", etc.
 
-# Ensure required data is downloaded (only needed once)
-nltk.download('punkt', quiet=True)
-nltk.download('punkt_tab', quiet=True)
-nltk.download('wordnet', quiet=True)
-nltk.download('omw-1.4', quiet=True)
+# Rebuilding the reference table costs minutes per cold start, so it is
+# cached on disk keyed by the inputs that shape it.
+CACHE_DIR = "cache"
+_cache_key = hashlib.md5(
+    f"{getattr(icdcodex, '__version__', 'unknown')}-{ICD_VERSION}".encode()
+).hexdigest()[:12]
+_ref_path = os.path.join(CACHE_DIR, f"icd_ref_{_cache_key}.parquet")
+_codes_path = os.path.join(CACHE_DIR, f"codes_{_cache_key}.pkl")
 
-lemmatizer = WordNetLemmatizer()
+if all(os.path.exists(p) for p in (_ref_path, _codes_path)):
+    icd_ref = pd.read_parquet(_ref_path, dtype_backend='pyarrow')
+    with open(_codes_path, "rb") as f:
+        icd_code_list = pickle.load(f)
+else:
+    _, icd_code_list = hierarchy.icd10cm(ICD_VERSION)
 
-# ========== Setup: Load ICD Hierarchy and Train Embeddings ==========
-# icd_graph, icd_code_list = hierarchy.icd10cm()
-# from icdcodex import hierarchy
-icd_graph, icd_code_list = hierarchy.icd10cm("2025")  # or "2024", etc.
+    # ========== Build ICD Reference Table with Descriptions ==========
+    # icd10.find returns None for unknown codes, so a comprehension into
+    # columnar form beats the old per-code try/except + list-of-dicts loop.
+    descriptions = [
+        obj.description if (obj := icd10.find(code)) else ""
+        for code in icd_code_list
+    ]
+    # Arrow-backed strings keep the ~70k entries as contiguous UTF-8 bytes
+    # instead of a Python-object column of pointers.
+    icd_ref = pd.DataFrame({
+        'code': pd.array(icd_code_list, dtype='string[pyarrow]'),
+        'description': pd.array(descriptions, dtype='string[pyarrow]')
+    })
 
-embedder = icd2vec.Icd2Vec(num_embedding_dimensions=64, workers=-1)
-embedder.fit(icd_graph, icd_code_list)
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    icd_ref.to_parquet(_ref_path, compression='zstd')
+    with open(_codes_path, "wb") as f:
+        pickle.dump(icd_code_list, f)
 
-# ========== Build ICD Reference Table with Descriptions ==========
-records = []
-for code in icd_code_list:
-    try:
-        obj = icd10.find(code)
-        desc = obj.description if obj else ""
-    except:
-        desc = ""
-    records.append({'code': code, 'description': desc})
+# Flatten the reference table into plain lists once, pre-applying RapidFuzz's
+# default_process so the per-query scan does not re-preprocess ~70k choices.
+# The raw descriptions are kept alongside for display; the processed forms
+# are for scoring only.
+RAW_DESCRIPTIONS = icd_ref['description'].tolist()
+DESCRIPTIONS = [default_process(d) for d in RAW_DESCRIPTIONS]
+CODES = icd_ref['code'].tolist()
 
-icd_ref = pd.DataFrame(records)
+# Descriptions reduced to the same stemmed vocabulary preprocess_input
+# emits — queries arrive Porter-stemmed, so matching against the unstemmed
+# forms would miss any word whose stem differs from its surface form. Both
+# the automaton and the fuzzy scan work on these; RAW_DESCRIPTIONS feeds
+# the UI.
+_STEMMED_DESCRIPTIONS = [
+    ' '.join(stemmer.stem(t) for t in d.split())
+    for d in DESCRIPTIONS
+]
+_AUTOMATON = ahocorasick.Automaton()
+for _i, _d in enumerate(_STEMMED_DESCRIPTIONS):
+    if _d:
+        _AUTOMATON.add_word(_d, (_i, _d))
+_AUTOMATON.make_automaton()
+
+# One throwaway scan at import time pages in the choice array and primes
+# RapidFuzz's lazy internals, so the first real request pays none of it.
+process.cdist(
+    ['warmup'],
+    _STEMMED_DESCRIPTIONS[:1000],
+    scorer=fuzz.token_set_ratio,
+    processor=None
+)
 
 # ========== Function to Find Matching ICD-10 Code ==========
-def find_icd_with_embedding(diagnosis, ref_df, top_k=3):
-    candidates = process.extract(
-        diagnosis,
-        ref_df['description'],
-        scorer=fuzz.token_sort_ratio,
-        limit=top_k
+@lru_cache(maxsize=1024)
+def _cached_search(diagnosis, top_k):
+    """
+    Run the fuzzy scan for a cleaned diagnosis string and return the top_k
+    hits as a hashable tuple of (code, description, score) tuples, so repeat
+    queries in a session are served from the cache.
+    """
+    query = default_process(diagnosis)
+
+    # Exact hits first: an automaton lookup is microseconds vs the O(N) scan.
+    # Hits are only accepted on whole-word boundaries, otherwise any short
+    # description occurring mid-word would count as an exact match.
+    exact = []
+    seen = set()
+    for end, (idx, desc) in _AUTOMATON.iter(query):
+        start = end - len(desc) + 1
+        if start > 0 and query[start - 1] != ' ':
+            continue
+        if end < len(query) - 1 and query[end + 1] != ' ':
+            continue
+        if idx not in seen:
+            seen.add(idx)
+            exact.append((CODES[idx], RAW_DESCRIPTIONS[idx], 100))
+    if len(exact) >= top_k:
+        return tuple(exact[:top_k])
+
+    # cdist scores the whole corpus in one vectorized (SIMD, multi-threaded)
+    # pass; uint8 output halves memory bandwidth vs the default float matrix.
+    scores = process.cdist(
+        [query],
+        _STEMMED_DESCRIPTIONS,
+        scorer=fuzz.token_set_ratio,
+        processor=None,
+        workers=-1,
+        score_cutoff=60,
+        dtype=np.uint8
+    )[0]
+    # scores is unsigned, so negating it for a descending argpartition would
+    # wrap modulo 256; partition ascending and take the tail instead.
+    top_idx = np.argpartition(scores, len(scores) - top_k)[-top_k:]
+    top_idx = top_idx[np.argsort(scores[top_idx])[::-1]]
+    # Entries zeroed by score_cutoff are not real matches; a query may
+    # legitimately yield fewer than top_k hits (or none at all).
+    return tuple(
+        (CODES[idx], RAW_DESCRIPTIONS[idx], int(scores[idx]))
+        for idx in top_idx
+        if scores[idx] > 0
     )
-    matches = []
-    for desc, score, idx in candidates:
-        code = ref_df.loc[idx, 'code']
-        vec_diag = embedder.to_vec([code])[0]
-        matches.append({
+
+def find_icd_matches(diagnosis, top_k=3):
+    hits = _cached_search(diagnosis, top_k)
+    matches = [None] * len(hits)
+    for i, (code, desc, score) in enumerate(hits):
+        matches[i] = {
             'icd_code': code,
             'icd_description': desc,
             'text_score': round(score, 5),
-            'justification': f"Matched '{desc}' ({score}%) based on fuzzy logic and ICD-10 vector proximity."
-        })
+            'justification': f"Matched '{desc}' ({score}%) based on fuzzy logic."
+        }
     return matches
 
 # Try to load the PayPal URL from the environment; if missing, use a placeholder
 paypal_url = os.getenv("PAYPAL_URL", "https://www.paypal.com/donate/dummy-link")
 
 # ========== Gradio Interface Logic ==========
+@lru_cache(maxsize=4096)
+def _preprocess(text):
+    text = _WS.sub(' ', _CLEAN.sub(' ', text.lower()))
+    tokens = _TOK.findall(text)
+    return ' '.join(stemmer.stem(word) for word in tokens)
+
 def preprocess_input(text):
     """
     Preprocess the diagnosis text by:
     - Lowercasing
     - Removing special characters
     - Normalising whitespace
-    - Lemmatising each word
+    - Stemming each word
     """
+    # Guard before the cache: unhashable non-str input would raise inside
+    # the lru_cache lookup otherwise.
     if not isinstance(text, str):
         return ""
+
+    return _preprocess(text)
     
-    text = text.lower()
-    text = re.sub(r'[^a-z0-9\s\-]', ' ', text)
-    text = re.sub(r'\s+', ' ', text).strip()
-    
-    tokens = nltk.word_tokenize(text)
-    lemmatized = [lemmatizer.lemmatize(word) for word in tokens]
-    return ' '.join(lemmatized)
-    
-def format_results(diagnosis, matches):
-    output_md = f"### 📋 Results for: **{diagnosis}**\n\n"
-    for match in matches:
-        output_md += f"""
-**ICD-10 Code:** `{match['icd_code']}`  
-**Description:** {match['icd_description']}  
-**Fuzzy Score:** `{match['text_score']:.5f}`  
-**Justification:** {match['justification']}
+_MATCH_TEMPLATE = """
+**ICD-10 Code:** `{icd_code}`  
+**Description:** {icd_description}  
+**Fuzzy Score:** `{text_score:.5f}`  
+**Justification:** {justification}
 
 ---
 """
-    return output_md
+
+def format_results(diagnosis, matches):
+    parts = [f"### 📋 Results for: **{diagnosis}**\n"]
+    if matches:
+        parts += [_MATCH_TEMPLATE.format(**match) for match in matches]
+    else:
+        parts.append("⚠️ No sufficiently close ICD-10 matches were found.")
+    return "\n".join(parts)
 
 def process_diagnosis(input_text):
     if not input_text.strip():
@@ -123,27 +207,64 @@ def process_diagnosis(input_text):
 
     initial_input = input_text.strip()
     cleaned_input = preprocess_input(initial_input)
-    matches = find_icd_with_embedding(cleaned_input, icd_ref, top_k=3)
+    matches = find_icd_matches(cleaned_input, top_k=3)
     result = format_results(initial_input, matches)
     return result
 
 def clear_input():
     return "", ""
 
+# Suggestions are queued and appended in batches by a background thread, so
+# the Gradio worker never blocks on file I/O.
+SUGGESTIONS_DIR = "/home/user/suggestions"
+_suggestion_queue = queue.Queue()
+_suggestion_flush = threading.Event()
+_suggestion_lock = threading.Lock()
+
+def _suggestion_filepath():
+    today_str = datetime.now().strftime("%Y-%m-%d")
+    return os.path.join(SUGGESTIONS_DIR, f"suggestions_{today_str}.txt")
+
+def _flush_suggestions():
+    # Serialize flushes: the writer thread, the request thread and atexit
+    # can all call this, and interleaved append handles would mix entries.
+    with _suggestion_lock:
+        entries = []
+        while True:
+            try:
+                entries.append(_suggestion_queue.get_nowait())
+            except queue.Empty:
+                break
+        if not entries:
+            return
+        os.makedirs(SUGGESTIONS_DIR, exist_ok=True)
+        with open(_suggestion_filepath(), "a", encoding="utf-8") as f:
+            for timestamp, text in entries:
+                f.write(f"[{timestamp}] {text}\n")
+
+def _suggestion_writer():
+    while True:
+        _suggestion_flush.wait(timeout=2)
+        _suggestion_flush.clear()
+        _flush_suggestions()
+
+threading.Thread(target=_suggestion_writer, daemon=True).start()
+atexit.register(_flush_suggestions)
+
 def save_suggestion(suggestion):
     if not suggestion.strip():
         return "⚠️ Please enter a suggestion.", None
 
-    # Save to a visible path
-    today_str = datetime.now().strftime("%Y-%m-%d")
-    base_dir = "/home/user/suggestions"
-    os.makedirs(base_dir, exist_ok=True)
-    filepath = os.path.join(base_dir, f"suggestions_{today_str}.txt")
+    timestamp = datetime.now().strftime("%H:%M:%S")
+    _suggestion_queue.put((timestamp, suggestion.strip()))
 
-    # Append suggestion
-    with open(filepath, "a", encoding="utf-8") as f:
-        timestamp = datetime.now().strftime("%H:%M:%S")
-        f.write(f"[{timestamp}] {suggestion.strip()}\n")
+    filepath = _suggestion_filepath()
+    if not os.path.exists(filepath):
+        # First suggestion of the day: flush now so the download component
+        # is handed a file that actually exists.
+        _flush_suggestions()
+    elif _suggestion_queue.qsize() >= 32:
+        _suggestion_flush.set()
 
     return "✅ Suggestion saved!", filepath
 
@@ -223,5 +344,7 @@ if __name__ == "__main__":
     # Determine if running on Hugging Face Spaces
     on_spaces = os.environ.get("SPACE_ID") is not None
     
-    # Launch the app conditionally
+    # Launch the app conditionally, with a bounded queue so concurrent
+    # submissions do not block each other.
+    app.queue(default_concurrency_limit=4, max_size=64)
     app.launch(share=not on_spaces)
\ No newline at end of file